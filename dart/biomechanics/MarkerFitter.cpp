@@ -22,6 +22,7 @@ MarkerFitterState::MarkerFitterState(
     Eigen::MatrixXs jointCenters,
     MarkerFitter* fitter)
   : markerOrder(fitter->mMarkerNames),
+    needGrad(true),
     skeleton(fitter->mSkeleton),
     markerObservations(markerObservations),
     joints(joints),
@@ -443,8 +444,11 @@ MarkerFitter::MarkerFitter(
   mLossAndGrad = [](MarkerFitterState* state) {
     s_t loss = state->markerErrorsAtTimesteps.squaredNorm()
                + state->jointErrorsAtTimesteps.squaredNorm();
-    state->markerErrorsAtTimestepsGrad = 2 * state->markerErrorsAtTimesteps;
-    state->jointErrorsAtTimestepsGrad = 2 * state->jointErrorsAtTimesteps;
+    if (state->needGrad)
+    {
+      state->markerErrorsAtTimestepsGrad = 2 * state->markerErrorsAtTimesteps;
+      state->jointErrorsAtTimestepsGrad = 2 * state->jointErrorsAtTimesteps;
+    }
     return loss;
   };
 }
@@ -3229,6 +3233,8 @@ s_t BilevelFitProblem::getLoss(Eigen::VectorXs x)
       mInitialization.joints,
       mJointCenters,
       mFitter);
+  // We only want the value here, so don't make the loss compute gradients
+  state.needGrad = false;
   return mFitter->mLossAndGrad(&state);
 }
 
@@ -3368,6 +3374,9 @@ Eigen::VectorXs BilevelFitProblem::getConstraints(Eigen::VectorXs x)
         mInitialization.joints,
         mJointCenters,
         mFitter);
+    // We only want the values here, so don't make the constraints compute
+    // gradients
+    state.needGrad = false;
 
     Eigen::VectorXs concatenatedConstraints = Eigen::VectorXs::Zero(
         ikGrad.size() + mFitter->mZeroConstraints.size());
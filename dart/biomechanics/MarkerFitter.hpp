@@ -67,6 +67,11 @@ struct MarkerFitterState
   Eigen::MatrixXs posesAtTimestepsGrad;
   Eigen::MatrixXs jointErrorsAtTimestepsGrad;
 
+  // This is false when the optimizer only wants the value of the loss (or
+  // constraint), and will never read the gradient, so custom losses can skip
+  // computing it.
+  bool needGrad;
+
   /// This unflattens an input vector, given some information about the problm
   MarkerFitterState(
       const Eigen::VectorXs& flat,
@@ -82,7 +82,9 @@ void MarkerFitter(py::module& m)
           &dart::biomechanics::MarkerFitterState::jointErrorsAtTimestepsGrad)
       .def_readwrite(
           "posesAtTimestepsGrad",
-          &dart::biomechanics::MarkerFitterState::posesAtTimestepsGrad);
+          &dart::biomechanics::MarkerFitterState::posesAtTimestepsGrad)
+      .def_readwrite(
+          "needGrad", &dart::biomechanics::MarkerFitterState::needGrad);
 
   ::py::class_<
       dart::biomechanics::BilevelFitResult,
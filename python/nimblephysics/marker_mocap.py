@@ -1,6 +1,6 @@
 import torch
 import nimblephysics_libs._nimblephysics as nimble
-from typing import List, Dict, Callable, Tuple
+from typing import List, Dict, Callable, Tuple, Optional
 import numpy as np
 from .loader import absPath
 from .gui_server import NimbleGUI
@@ -8,79 +8,201 @@ import random
 import traceback
 
 
+def _getRawArrays(rawState: nimble.biomechanics.MarkerFitterState) -> List[np.ndarray]:
+  """
+  This reads each of the state arrays off a MarkerFitterState exactly once. Every attribute read is a separate trip
+  through pybind11 that builds a fresh numpy wrapper, so we don't want to do it more often than we have to.
+  """
+  return [
+      rawState.bodyScales,
+      rawState.markerOffsets,
+      rawState.markerErrorsAtTimesteps,
+      rawState.jointErrorsAtTimesteps,
+      rawState.posesAtTimesteps]
+
+
 class MarkerMocapOptimizationState:
   """
-  This wraps a MarkerFitterState, but using PyTorch Tensors, so we can autograd any arbitrary user-supplied loss function
+  This wraps a MarkerFitterState, but using PyTorch Tensors, so we can autograd any arbitrary user-supplied loss function.
+  The tensors are reused across optimizer calls, so clone anything you want to keep. Matrices only record gradients
+  once something reads them, from then on for every later loss and constraint too.
   """
-  rawState: nimble.biomechanics.MarkerFitterState
+  rawState: Optional[nimble.biomechanics.MarkerFitterState]
   numTimesteps: int
-  bodyScales: Dict[str, torch.Tensor]
-  markerOffsets: Dict[str, torch.Tensor]
-  markerErrorsAtTimesteps: List[Dict[str, torch.Tensor]]
-  jointErrorsAtTimesteps: List[Dict[str, torch.Tensor]]
-  posesAtTimesteps: List[torch.Tensor]
+  bodyNameToIdx: Dict[str, int]
+  markerNameToIdx: Dict[str, int]
+  jointNameToIdx: Dict[str, int]
 
   def __init__(self, rawState: nimble.biomechanics.MarkerFitterState) -> None:
-    self.rawState: nimble.biomechanics.MarkerFitterState = rawState
-    self.bodyScales: Dict[str, torch.Tensor] = {}
-    self.markerOffsets: Dict[str, torch.Tensor] = {}
-    self.markerErrorsAtTimesteps: List[Dict[str, torch.Tensor]] = []
-    self.jointErrorsAtTimesteps: List[Dict[str, torch.Tensor]] = []
-    self.posesAtTimesteps: List[torch.Tensor] = []
-    self.numTimesteps = len(rawState.jointErrorsAtTimesteps)
-
-    for i in range(len(rawState.bodyNames)):
-      self.bodyScales[rawState.bodyNames[i]] = torch.tensor(
-          np.copy(rawState.bodyScales[:, i]), requires_grad=True)
-
-    for i in range(len(rawState.markerOrder)):
-      self.markerOffsets[rawState.markerOrder[i]] = torch.tensor(
-          np.copy(rawState.markerOffsets[:, i]), requires_grad=True)
-
-    for t in range(len(rawState.markerErrorsAtTimesteps)):
-      markerErrors: Dict[str, torch.Tensor] = {}
-      for i in range(len(rawState.markerOrder)):
-        markerErrors[rawState.markerOrder[i]] = torch.tensor(
-            np.copy(rawState.markerErrorsAtTimesteps[t*3:(t+1)*3, i]),
-            requires_grad=True)
-      self.markerErrorsAtTimesteps.append(markerErrors)
-
-    for t in range(len(rawState.jointErrorsAtTimesteps)):
-      jointErrors: Dict[str, torch.Tensor] = {}
-      for i in range(len(rawState.jointOrder)):
-        jointErrors[rawState.jointOrder[i]] = torch.tensor(
-            np.copy(rawState.jointErrorsAtTimesteps[t*3:(t+1)*3, i]),
-            requires_grad=True)
-      self.jointErrorsAtTimesteps.append(jointErrors)
-
-    for t in range(rawState.posesAtTimesteps.shape[1]):
-      self.posesAtTimesteps.append(torch.tensor(
-          np.copy(rawState.posesAtTimesteps[:, t]), requires_grad=True))
+    self.rawState = rawState
+    # We copy each raw array over exactly once, into a single leaf tensor, and
+    # then hand out views into those leaves by name and timestep. Gradients
+    # from the views all accumulate into the shared leaves.
+    raws: List[np.ndarray] = _getRawArrays(rawState)
+    # The raw arrays are views of (column-major) C++ memory, so we always copy into fresh buffers we own
+    buffers: List[np.ndarray] = [np.array(raw, order='C') for raw in raws]
+    # The leaves only start requiring gradients once the loss actually reads them (see _touch()), so autograd doesn't
+    # record anything for parts of the state the loss never looks at
+    self._bodyScalesMatrix, self._markerOffsetsMatrix, self._markerErrorsMatrix, self._jointErrorsMatrix, \
+        self._posesMatrix = [torch.from_numpy(buffer) for buffer in buffers]
+    # We give every leaf a zeroed .grad up front. Autograd accumulates into an existing .grad in place, so each leaf
+    # keeps this one buffer for as long as we're pooled (see updateFromRawState()), and fillGradients() can hand it
+    # straight back without checking whether the loss ever touched the leaf.
+    for leaf in self._leaves():
+      leaf.grad = torch.zeros_like(leaf)
+    # Errors are stacked 3 rows per timestep
+    self.numTimesteps = self._markerErrorsMatrix.shape[0] // 3
+
+    self._bodyNames: List[str] = rawState.bodyNames
+    self._markerOrder: List[str] = rawState.markerOrder
+    self._jointOrder: List[str] = rawState.jointOrder
+    self.bodyNameToIdx = {name: i for i, name in enumerate(self._bodyNames)}
+    self.markerNameToIdx = {name: i for i, name in enumerate(self._markerOrder)}
+    self.jointNameToIdx = {name: i for i, name in enumerate(self._jointOrder)}
+
+    # These get built the first time they're asked for
+    self._bodyScales: Optional[Dict[str, torch.Tensor]] = None
+    self._markerOffsets: Optional[Dict[str, torch.Tensor]] = None
+    self._markerErrorsAtTimesteps: Optional[List[Dict[str, torch.Tensor]]] = None
+    self._jointErrorsAtTimesteps: Optional[List[Dict[str, torch.Tensor]]] = None
+    self._posesAtTimesteps: Optional[List[torch.Tensor]] = None
+
+  def _leaves(self) -> List[torch.Tensor]:
+    return [
+        self._bodyScalesMatrix,
+        self._markerOffsetsMatrix,
+        self._markerErrorsMatrix,
+        self._jointErrorsMatrix,
+        self._posesMatrix]
+
+  @staticmethod
+  def _touch(leaf: torch.Tensor) -> torch.Tensor:
+    if not leaf.requires_grad:
+      leaf.requires_grad_(True)
+    return leaf
+
+  @property
+  def bodyScalesMatrix(self) -> torch.Tensor:
+    return self._touch(self._bodyScalesMatrix)
+
+  @property
+  def markerOffsetsMatrix(self) -> torch.Tensor:
+    return self._touch(self._markerOffsetsMatrix)
+
+  @property
+  def markerErrorsMatrix(self) -> torch.Tensor:
+    return self._touch(self._markerErrorsMatrix)
+
+  @property
+  def jointErrorsMatrix(self) -> torch.Tensor:
+    return self._touch(self._jointErrorsMatrix)
+
+  @property
+  def posesMatrix(self) -> torch.Tensor:
+    return self._touch(self._posesMatrix)
+
+  @property
+  def bodyScales(self) -> Dict[str, torch.Tensor]:
+    if self._bodyScales is None:
+      # unbind() slices a whole matrix into views in a single call, which is much cheaper than indexing out every
+      # column from Python. We hang onto these views across calls, so they have to be built with autograd on, even if
+      # we first get asked for them while evaluating a loss without gradients.
+      with torch.enable_grad():
+        self._bodyScales = dict(zip(self._bodyNames, self.bodyScalesMatrix.unbind(1)))
+    return self._bodyScales
+
+  @property
+  def markerOffsets(self) -> Dict[str, torch.Tensor]:
+    if self._markerOffsets is None:
+      with torch.enable_grad():
+        self._markerOffsets = dict(zip(self._markerOrder, self.markerOffsetsMatrix.unbind(1)))
+    return self._markerOffsets
+
+  @property
+  def markerErrorsAtTimesteps(self) -> List[Dict[str, torch.Tensor]]:
+    if self._markerErrorsAtTimesteps is None:
+      with torch.enable_grad():
+        markerErrorsByTimestep: torch.Tensor = self.markerErrorsMatrix.view(
+            self.numTimesteps, 3, len(self._markerOrder))
+        self._markerErrorsAtTimesteps = [
+            dict(zip(self._markerOrder, markerErrors.unbind(1))) for markerErrors in markerErrorsByTimestep.unbind(0)]
+    return self._markerErrorsAtTimesteps
+
+  @property
+  def jointErrorsAtTimesteps(self) -> List[Dict[str, torch.Tensor]]:
+    if self._jointErrorsAtTimesteps is None:
+      # Joint errors are laid out the other way around from marker errors: 3 rows per joint, one column per timestep
+      with torch.enable_grad():
+        jointErrorsByTimestep: torch.Tensor = self.jointErrorsMatrix.view(
+            len(self._jointOrder), 3, self._jointErrorsMatrix.shape[1]).permute(2, 0, 1)
+        self._jointErrorsAtTimesteps = [
+            dict(zip(self._jointOrder, jointErrors.unbind(0))) for jointErrors in jointErrorsByTimestep.unbind(0)]
+    return self._jointErrorsAtTimesteps
+
+  @property
+  def posesAtTimesteps(self) -> List[torch.Tensor]:
+    if self._posesAtTimesteps is None:
+      with torch.enable_grad():
+        self._posesAtTimesteps = list(self.posesMatrix.unbind(1))
+    return self._posesAtTimesteps
+
+  def _prepareForCompiledLoss(self) -> None:
+    """
+    torch.compile() can't trace _touch() turning on gradients, so compiled losses get every matrix turned on up front.
+    The by-name dicts and per-timestep lists are still built lazily, which compiled losses can't trace either, so they
+    should stick to the matrices and the accessors (bodyScale(), markerError(), ...).
+    """
+    for leaf in self._leaves():
+      self._touch(leaf)
+
+  def bodyScale(self, bodyName: str) -> torch.Tensor:
+    return self.bodyScalesMatrix[:, self.bodyNameToIdx[bodyName]]
+
+  def markerOffset(self, markerName: str) -> torch.Tensor:
+    return self.markerOffsetsMatrix[:, self.markerNameToIdx[markerName]]
+
+  def markerError(self, markerName: str, timestep: int) -> torch.Tensor:
+    return self.markerErrorsMatrix[timestep*3:(timestep+1)*3, self.markerNameToIdx[markerName]]
+
+  def jointError(self, jointName: str, timestep: int) -> torch.Tensor:
+    jointIdx: int = self.jointNameToIdx[jointName]
+    return self.jointErrorsMatrix[jointIdx*3:(jointIdx+1)*3, timestep]
+
+  def pose(self, timestep: int) -> torch.Tensor:
+    return self.posesMatrix[:, timestep]
+
+  def updateFromRawState(self, rawState: nimble.biomechanics.MarkerFitterState) -> bool:
+    """
+    If rawState has exactly the same shape (and names) as the state we were built from, coming from the same
+    MarkerFitter, this copies it into our existing tensors in place and clears any old gradients, so we don't have to
+    reallocate everything on every call from the optimizer. Otherwise this returns False, and leaves us untouched.
+    """
+    raws: List[np.ndarray] = _getRawArrays(rawState)
+    leaves: List[torch.Tensor] = self._leaves()
+    if any(tuple(leaf.shape) != raw.shape for leaf, raw in zip(leaves, raws)):
+      return False
+    # The bodies and markers are fixed for a given fitter, so we only need to check the joints. Every name list we
+    # read is another copy across from C++, so we skip the ones we don't need.
+    if self._jointOrder != rawState.jointOrder:
+      return False
+
+    self.rawState = rawState
+    # All the views we handed out share storage with the leaves, so they see the new values too
+    for leaf, raw in zip(leaves, raws):
+      np.copyto(leaf.detach().numpy(), raw)
+    for leaf in leaves:
+      # Leaves that don't require gradients never had anything accumulated into their (zero) .grad
+      if leaf.requires_grad:
+        leaf.grad.zero_()
+    return True
 
   def fillGradients(self, finalLoss: torch.Tensor) -> None:
     finalLoss.backward()
 
-    bodyScalesGrad: np.ndarray = np.zeros_like(self.rawState.bodyScales)
-    for i in range(len(self.rawState.bodyNames)):
-      bodyName = self.rawState.bodyNames[i]
-      if self.bodyScales[bodyName].grad is not None:
-        bodyScalesGrad[:, i] = self.bodyScales[bodyName].grad.numpy()
-    self.rawState.bodyScalesGrad = bodyScalesGrad
-
-    markerOffsetsGrad: np.ndarray = np.zeros_like(self.rawState.markerOffsets)
-    for i in range(len(self.rawState.markerOrder)):
-      markerName = self.rawState.markerOrder[i]
-      if self.markerOffsets[markerName].grad is not None:
-        markerOffsetsGrad[:, i] = self.markerOffsets[markerName].grad.numpy()
-    self.rawState.markerOffsetsGrad = markerOffsetsGrad
-
-    markerErrorsGrad: np.ndarray = np.zeros_like(self.rawState.markerErrorsAtTimesteps)
-    for t in range(len(self.markerErrorsAtTimesteps)):
-      for i in range(len(self.rawState.markerOrder)):
-        markerName = self.rawState.markerOrder[i]
-        if self.markerErrorsAtTimesteps[t][markerName].grad is not None:
-          markerErrorsGrad[t*3:(t+1)*3,
-                           i] = self.markerErrorsAtTimesteps[t][markerName].grad.numpy()
+    self.rawState.bodyScalesGrad = self._bodyScalesMatrix.grad.numpy()
+    self.rawState.markerOffsetsGrad = self._markerOffsetsMatrix.grad.numpy()
+
+    markerErrorsGrad: np.ndarray = self._markerErrorsMatrix.grad.numpy()
     self.rawState.markerErrorsAtTimestepsGrad = markerErrorsGrad
 
     """
@@ -92,13 +214,7 @@ class MarkerMocapOptimizationState:
     print(markerErrorsGrad)
     """
 
-    jointErrorsGrad: np.ndarray = np.zeros_like(self.rawState.jointErrorsAtTimesteps)
-    for t in range(len(self.jointErrorsAtTimesteps)):
-      for i in range(len(self.rawState.jointOrder)):
-        jointName = self.rawState.jointOrder[i]
-        if self.jointErrorsAtTimesteps[t][jointName].grad is not None:
-          jointErrorsGrad[t*3:(t+1)*3,
-                          i] = self.jointErrorsAtTimesteps[t][jointName].grad.numpy()
+    jointErrorsGrad: np.ndarray = self._jointErrorsMatrix.grad.numpy()
     self.rawState.jointErrorsAtTimestepsGrad = jointErrorsGrad
 
     """
@@ -110,11 +226,7 @@ class MarkerMocapOptimizationState:
     print(jointErrorsGrad)
     """
 
-    posesAtTimestepsGrad: np.ndarray = np.zeros_like(self.rawState.posesAtTimesteps)
-    for t in range(len(self.posesAtTimesteps)):
-      if self.posesAtTimesteps[t].grad is not None:
-        posesAtTimestepsGrad[:, t] = self.posesAtTimesteps[t].grad.numpy()
-    self.rawState.posesAtTimestepsGrad = posesAtTimestepsGrad
+    self.rawState.posesAtTimestepsGrad = self._posesMatrix.grad.numpy()
 
 
 class MarkerMocap:
@@ -125,6 +237,7 @@ class MarkerMocap:
   skel: nimble.dynamics.Skeleton
   skelOriginalPose: np.ndarray
   markersMap: Dict[str, Tuple[nimble.dynamics.BodyNode, np.ndarray]]
+  _statePool: Optional[MarkerMocapOptimizationState]
 
   def __init__(self, skel: nimble.dynamics.Skeleton,
                markersMap: Dict[str, Tuple[nimble.dynamics.BodyNode, np.ndarray]]) -> None:
@@ -140,14 +253,62 @@ class MarkerMocap:
                                Callable
                                [[nimble.biomechanics.MarkerFitterState],
                                 float]] = {}
+    self._statePool = None
 
-  def setCustomLoss(self, lossFn: Callable[[MarkerMocapOptimizationState], torch.Tensor]) -> None:
-    def wrappedLoss(rawState: nimble.biomechanics.MarkerFitterState) -> float:
-      try:
-        wrappedState = MarkerMocapOptimizationState(rawState)
+  def _getOptimizationState(
+          self, rawState: nimble.biomechanics.MarkerFitterState) -> MarkerMocapOptimizationState:
+    """
+    The optimizer calls our losses and constraints many times with same-shaped states, so we keep one
+    MarkerMocapOptimizationState around and copy each new rawState into it, instead of rebuilding all the tensors
+    """
+    if self._statePool is None or not self._statePool.updateFromRawState(rawState):
+      self._statePool = MarkerMocapOptimizationState(rawState)
+    return self._statePool
+
+  def _releaseRawState(self) -> None:
+    """
+    The rawState we get handed only lives for the duration of a single call from the fitter, so we mustn't keep
+    pointing at it from our pooled state once the call returns
+    """
+    if self._statePool is not None:
+      self._statePool.rawState = None
+
+  def _evaluateOnState(self, rawState: nimble.biomechanics.MarkerFitterState,
+                       lossFn: Callable[[MarkerMocapOptimizationState], torch.Tensor],
+                       compiled: bool = False) -> float:
+    """
+    This runs lossFn on our pooled copy of rawState, and writes the gradients back to rawState if the fitter wants them
+    """
+    try:
+      needGrad: bool = rawState.needGrad
+      wrappedState = self._getOptimizationState(rawState)
+      if compiled:
+        wrappedState._prepareForCompiledLoss()
+      # When the optimizer only wants the value, don't record anything for autograd
+      with torch.enable_grad() if needGrad else torch.no_grad():
         loss: torch.Tensor = lossFn(wrappedState)
+      if needGrad:
         wrappedState.fillGradients(loss)
-        return loss.item()
+      return loss.item()
+    finally:
+      self._releaseRawState()
+
+  def setCustomLoss(self, lossFn: Callable[[MarkerMocapOptimizationState], torch.Tensor],
+                    compileLoss: bool = False) -> None:
+    """
+    This sets the loss the fitter minimizes. If `compileLoss` is True, the loss is run through torch.compile(), which
+    only pays off for losses written against the whole matrices and the accessors (bodyScale(), markerError(), ...),
+    not the by-name dicts and per-timestep lists. Each problem shape and autograd mode (value-only calls run under
+    no_grad()) compiles separately and counts against torch._dynamo.config.cache_size_limit, so the default limit of 8
+    covers about 4 shapes, past which torch falls back to running the loss eagerly.
+    """
+    canCompile = compileLoss and hasattr(torch, 'compile')
+    # Dynamo's guards already recompile for each new problem shape and grad mode, so we only need one compiled wrapper
+    runLoss = torch.compile(lossFn, dynamic=False) if canCompile else lossFn
+
+    def wrappedLoss(rawState: nimble.biomechanics.MarkerFitterState) -> float:
+      try:
+        return self._evaluateOnState(rawState, runLoss, canCompile)
       except Exception as e:
         print(traceback.format_exc())
         return 0
@@ -159,10 +320,7 @@ class MarkerMocap:
                                             torch.Tensor]) -> None:
     def wrappedLoss(rawState: nimble.biomechanics.MarkerFitterState):
       try:
-        wrappedState = MarkerMocapOptimizationState(rawState)
-        loss: torch.Tensor = lossFn(wrappedState)
-        wrappedState.fillGradients(loss)
-        return loss.item()
+        return self._evaluateOnState(rawState, lossFn)
       except Exception as e:
         print(e)
     self.zeroConstraints[name] = wrappedLoss
@@ -226,9 +384,15 @@ class MarkerMocap:
                           handScaledGoldBodyOsim: str,
                           handScaledGoldIKMot: str,
                           numStepsToFit: int = 3,
-                          debugToGUI: bool = True) -> nimble.biomechanics.MarkerInitialization:
+                          debugToGUI: bool = True,
+                          guiRecordingPath: Optional[str] = None) -> nimble.biomechanics.MarkerInitialization:
     """
     This compares the performance of the MarkerMocap system to a manual fit process, and prints a number of stats
+
+    If `debugToGUI` is set, this also shows the fit against the gold poses and markers, animated through a live web
+    GUI. If `guiRecordingPath` is given (whether or not `debugToGUI` is set), we instead render the whole animation
+    once into a GUIRecording and write it out as JSON, which the standalone web viewer can play back (and pause, with
+    space) on its own, without anything left running on the Python side.
     """
     markerTrcPathAbs: str = absPath(markerTrcPath)
     print("Loading "+markerTrcPathAbs)
@@ -295,70 +459,122 @@ class MarkerMocap:
     print('Fine tuned IK:')
     resultIK.printReport(limitTimesteps=10)
 
-    if debugToGUI:
-      world: nimble.simulation.World = nimble.simulation.World()
-      gui: NimbleGUI = NimbleGUI(world)
-
+    if debugToGUI or guiRecordingPath is not None:
       ourColor = [235. / 255, 32. / 255, 14. / 255]
       goldColor = [26. / 255, 99. / 255, 235. / 255]
 
-      def renderTimestep(timestep):
-        # Render our guessed position
-        self.skel.setPositions(result.poses[:, timestep])
-        gui.nativeAPI().renderSkeleton(self.skel, 'result')
+      # This is what we last sent to the GUI for each marker, as (real, ours, gold) positions, or NaN if the marker
+      # isn't currently shown. Markers that moved less than markerMovedThreshold (meters) since then are not resent.
+      markerNames: List[str] = list(self.markersMap.keys())
+      lastSentMarkers: np.ndarray = np.full((len(markerNames), 3, 3), np.nan)
+      markerMovedThreshold = 1e-5
+
+      # The fit and the gold poses never change while we're animating, so we only need to run forward kinematics to
+      # find the markers once per timestep, no matter how many times we loop over the animation
+      markerPositionsCache: Dict[int, Tuple[np.ndarray, np.ndarray]] = {}
+
+      def getMarkerPositions(timestep: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        This returns the [numMarkers, (real, ours, gold), 3] marker positions at a timestep, along with a mask of which
+        markers were observed. This expects both skeletons to already be in their poses for `timestep`.
+        """
+        if timestep in markerPositionsCache:
+          return markerPositionsCache[timestep]
 
         # Calculate where we think markers are
         observedMarkers: Dict[str, np.ndarray] = self.skel.getMarkerMapWorldPositions(
             fitMarkers)
-
-        # Render the gold position
-        scaledOsim.skeleton.setPositions(goldPoses[:, timestep])
-        gui.nativeAPI().renderSkeleton(scaledOsim.skeleton, 'gold', goldColor)
-
-        # Render compared marker positions
         goldMarkers: Dict[str, np.ndarray] = scaledOsim.skeleton.getMarkerMapWorldPositions(
             scaledOsim.markersMap)
         realMarkers: Dict[str, np.ndarray] = markerObservations[timestep]
-        for markerName in self.markersMap:
+
+        # Gather all the marker positions into one array, so we can figure out which markers actually moved in one
+        # shot, and only send those over to the GUI
+        markerPositions: np.ndarray = np.full((len(markerNames), 3, 3), np.nan)
+        observed: np.ndarray = np.zeros(len(markerNames), dtype=bool)
+        for i, markerName in enumerate(markerNames):
           # Not all markers are observed at all timesteps
           if markerName in realMarkers:
-            # Make a triangle between the 3 points
-            goldErrorLine = [
-                realMarkers[markerName],
-                goldMarkers[markerName]]
-            gui.nativeAPI().createLine(markerName + "_goldError", goldErrorLine, goldColor)
-            ourErrorLine = [
-                realMarkers[markerName],
-                observedMarkers[markerName]]
-            gui.nativeAPI().createLine(markerName + "_ourError", ourErrorLine, ourColor)
-
-            gui.nativeAPI().createBox(
-                markerName + "_found", [0.003, 0.003, 0.003],
-                observedMarkers[markerName],
-                [0, 0, 0],
-                ourColor)
-            gui.nativeAPI().createBox(
-                markerName + "_gold", [0.003, 0.003, 0.003],
-                goldMarkers[markerName],
-                [0, 0, 0],
-                goldColor)
-            gui.nativeAPI().createBox(
-                markerName + "_real", [0.005, 0.005, 0.005],
-                realMarkers[markerName],
-                [0, 0, 0],
-                [1, 1, 0])
-          else:
-            gui.nativeAPI().deleteObject(markerName)
-            gui.nativeAPI().deleteObject(markerName+"_goldError")
-            gui.nativeAPI().deleteObject(markerName+"_ourError")
-            gui.nativeAPI().deleteObject(markerName+"_found")
-            gui.nativeAPI().deleteObject(markerName+"_gold")
-            gui.nativeAPI().deleteObject(markerName+"_real")
-        gui.nativeAPI().flush()
+            observed[i] = True
+            markerPositions[i, 0] = realMarkers[markerName]
+            markerPositions[i, 1] = observedMarkers[markerName]
+            markerPositions[i, 2] = goldMarkers[markerName]
+        markerPositionsCache[timestep] = (markerPositions, observed)
+        return markerPositionsCache[timestep]
+
+      def renderTimestep(api: nimble.server.GUIStateMachine, timestep: int, deleteAllUnobserved: bool = False):
+        """
+        This queues up everything that changed in the scene to get to `timestep` on `api`, without flushing it. With
+        `deleteAllUnobserved`, this deletes every unobserved marker, whether or not we think it's currently shown.
+        """
+        # Render our guessed position
+        self.skel.setPositions(result.poses[:, timestep])
+        api.renderSkeleton(self.skel, 'result')
+
+        # Render the gold position
+        scaledOsim.skeleton.setPositions(goldPoses[:, timestep])
+        api.renderSkeleton(scaledOsim.skeleton, 'gold', goldColor)
+
+        # Render compared marker positions
+        currentMarkers, observed = getMarkerPositions(timestep)
+        shown: np.ndarray = np.ones(len(markerNames), dtype=bool) if deleteAllUnobserved else ~np.isnan(
+            lastSentMarkers[:, 0, 0])
+        # Markers we've never shown compare as NaN, so they always count as moved
+        moved: np.ndarray = observed & ~np.all(
+            np.abs(currentMarkers - lastSentMarkers) <= markerMovedThreshold, axis=(1, 2))
+
+        for i in np.nonzero(moved)[0]:
+          markerName = markerNames[i]
+          real, ours, gold = currentMarkers[i]
+          # Make a triangle between the 3 points
+          api.createLine(markerName + "_goldError", [real, gold], goldColor)
+          api.createLine(markerName + "_ourError", [real, ours], ourColor)
+
+          api.createBox(
+              markerName + "_found", [0.003, 0.003, 0.003],
+              ours,
+              [0, 0, 0],
+              ourColor)
+          api.createBox(
+              markerName + "_gold", [0.003, 0.003, 0.003],
+              gold,
+              [0, 0, 0],
+              goldColor)
+          api.createBox(
+              markerName + "_real", [0.005, 0.005, 0.005],
+              real,
+              [0, 0, 0],
+              [1, 1, 0])
+        lastSentMarkers[moved] = currentMarkers[moved]
+
+        for i in np.nonzero(shown & ~observed)[0]:
+          markerName = markerNames[i]
+          api.deleteObject(markerName+"_goldError")
+          api.deleteObject(markerName+"_ourError")
+          api.deleteObject(markerName+"_found")
+          api.deleteObject(markerName+"_gold")
+          api.deleteObject(markerName+"_real")
+        lastSentMarkers[~observed] = np.nan
+
+      if guiRecordingPath is not None:
+        recording: nimble.server.GUIRecording = nimble.server.GUIRecording()
+        recording.renderBasis()
+        for timestep in range(result.poses.shape[1]):
+          # The player loops straight from the last frame back to the first without clearing the scene, so the first
+          # frame has to clear out anything still left over from the end of the trial
+          renderTimestep(recording, timestep, deleteAllUnobserved=(timestep == 0))
+          recording.saveFrame()
+        recording.writeFramesJson(guiRecordingPath)
+        print('Wrote GUI recording of '+str(recording.getNumFrames())+' frames to '+guiRecordingPath)
+        return result
+
+      world: nimble.simulation.World = nimble.simulation.World()
+      gui: NimbleGUI = NimbleGUI(world)
 
       cursor = 0
       playing = True
-      renderTimestep(cursor)
+      renderTimestep(gui.nativeAPI(), cursor)
+      gui.nativeAPI().flush()
 
       def keyListener(key: str):
         nonlocal playing
@@ -372,7 +588,8 @@ class MarkerMocap:
           cursor += 1
           if cursor >= result.poses.shape[1]:
             cursor = 0
-          renderTimestep(cursor)
+          renderTimestep(gui.nativeAPI(), cursor)
+          gui.nativeAPI().flush()
 
       ticker = nimble.realtime.Ticker(1.0 / 60)
       ticker.registerTickListener(onTick)
@@ -47,13 +47,10 @@ originalPos = skel.getPositions()
 def customLoss(mocapState: nimble.MarkerMocapOptimizationState):
   sum = torch.zeros(1)
 
-  for t in range(mocapState.numTimesteps):
-    for markerName in mocapState.markerErrorsAtTimesteps[t]:
-      sum += mocapState.markerErrorsAtTimesteps[t][markerName].dot(
-          mocapState.markerErrorsAtTimesteps[t][markerName])
-    for jointName in mocapState.jointErrorsAtTimesteps[t]:
-      sum += mocapState.jointErrorsAtTimesteps[t][jointName].dot(
-          mocapState.jointErrorsAtTimesteps[t][jointName])
+  # Working on the whole error matrices at once is much cheaper than looping over every
+  # marker and joint at every timestep
+  sum += torch.sum(torch.square(mocapState.markerErrorsMatrix))
+  sum += torch.sum(torch.square(mocapState.jointErrorsMatrix))
 
   """
   # Have a strong preference that the torso+head+pelvis doesn't scale too much to get the required height
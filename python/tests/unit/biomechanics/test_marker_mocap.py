@@ -0,0 +1,288 @@
+import pytest
+import numpy as np
+import torch
+import nimblephysics as nimble
+from nimblephysics.marker_mocap import MarkerMocap, MarkerMocapOptimizationState
+
+
+GRAD_NAMES = [
+    'bodyScalesGrad',
+    'markerOffsetsGrad',
+    'markerErrorsAtTimestepsGrad',
+    'jointErrorsAtTimestepsGrad',
+    'posesAtTimestepsGrad']
+
+
+class RawState:
+    '''
+    MarkerFitterState can't be constructed from Python, so this stands in for
+    one with the same fields. Like the pybind11 bindings, the arrays it hands
+    out are read-only and column-major, and assigning a gradient copies it.
+    Joint errors are laid out [3 * numJoints, numTimesteps], like in C++.
+    '''
+
+    FIELDS = [
+        'bodyNames',
+        'markerOrder',
+        'jointOrder',
+        'bodyScales',
+        'markerOffsets',
+        'markerErrorsAtTimesteps',
+        'jointErrorsAtTimesteps',
+        'posesAtTimesteps',
+        'needGrad']
+
+    def __init__(self, seed, numTimesteps=4, numMarkers=3, numJoints=2,
+                 numBodies=2, numDofs=5, needGrad=True):
+        rng = np.random.default_rng(seed)
+
+        def readOnly(shape):
+            array = np.asfortranarray(rng.normal(size=shape))
+            array.setflags(write=False)
+            return array
+
+        self.bodyNames = ['body' + str(i) for i in range(numBodies)]
+        self.markerOrder = ['marker' + str(i) for i in range(numMarkers)]
+        self.jointOrder = ['joint' + str(i) for i in range(numJoints)]
+        self.bodyScales = readOnly((3, numBodies))
+        self.markerOffsets = readOnly((3, numMarkers))
+        self.markerErrorsAtTimesteps = readOnly((3 * numTimesteps, numMarkers))
+        self.jointErrorsAtTimesteps = readOnly((3 * numJoints, numTimesteps))
+        self.posesAtTimesteps = readOnly((numDofs, numTimesteps))
+        self.needGrad = needGrad
+
+    @staticmethod
+    def copyOf(other):
+        copy = object.__new__(RawState)
+        for name in RawState.FIELDS:
+            object.__setattr__(copy, name, getattr(other, name))
+        return copy
+
+    def __setattr__(self, name, value):
+        if name.endswith('Grad'):
+            value = np.array(value, dtype=np.float64, order='F')
+        object.__setattr__(self, name, value)
+
+
+def createMocap():
+    skel = nimble.dynamics.Skeleton()
+    [joint0, body0] = skel.createFreeJointAndBodyNodePair()
+    return MarkerMocap(skel, {'marker0': (body0, np.zeros(3))})
+
+
+def matrixLoss(state):
+    return (torch.sum(torch.square(state.markerErrorsMatrix))
+            + torch.sum(torch.sin(state.jointErrorsMatrix))
+            + torch.sum(state.bodyScalesMatrix ** 3)
+            + torch.sum(state.posesMatrix * 2))
+
+
+def dictLoss(state):
+    loss = torch.sum(state.bodyScales['body1'] ** 2)
+    for t in range(state.numTimesteps):
+        loss = loss + torch.sum(state.markerErrorsAtTimesteps[t]['marker2'] * (t + 1))
+        loss = loss + torch.sum(torch.square(state.jointErrorsAtTimesteps[t]['joint0']))
+    return loss
+
+
+def accessorLoss(state):
+    loss = torch.sum(state.bodyScale('body1') ** 2)
+    for t in range(state.numTimesteps):
+        loss = loss + torch.sum(state.markerError('marker2', t) * (t + 1))
+        loss = loss + torch.sum(torch.square(state.jointError('joint0', t)))
+    return loss
+
+
+def sumOfSquaresLoss(state):
+    return torch.sum(torch.square(state.markerErrorsMatrix)) + torch.sum(torch.square(state.jointErrorsMatrix))
+
+
+def referenceGradients(rawState, lossFn):
+    '''
+    This runs lossFn on a freshly built state, with nothing pooled
+    '''
+    reference = RawState.copyOf(rawState)
+    state = MarkerMocapOptimizationState(reference)
+    loss = lossFn(state)
+    state.fillGradients(loss)
+    return loss.item(), {name: getattr(reference, name) for name in GRAD_NAMES}
+
+
+def test_pooled_state_gradients_match_closed_form():
+    mocap = createMocap()
+    mocap.setCustomLoss(sumOfSquaresLoss)
+    pooled = None
+    for seed in range(4):
+        rawState = RawState(seed)
+        loss = mocap.wrappedLoss(rawState)
+        if pooled is None:
+            pooled = mocap._statePool
+        # Same shapes and names every time, so we keep reusing one state
+        assert mocap._statePool is pooled
+        assert loss == pytest.approx(
+            np.sum(np.square(rawState.markerErrorsAtTimesteps)) + np.sum(np.square(rawState.jointErrorsAtTimesteps)))
+        np.testing.assert_allclose(rawState.markerErrorsAtTimestepsGrad, 2 * rawState.markerErrorsAtTimesteps)
+        np.testing.assert_allclose(rawState.jointErrorsAtTimestepsGrad, 2 * rawState.jointErrorsAtTimesteps)
+        np.testing.assert_array_equal(rawState.bodyScalesGrad, np.zeros(rawState.bodyScales.shape))
+        np.testing.assert_array_equal(rawState.markerOffsetsGrad, np.zeros(rawState.markerOffsets.shape))
+        np.testing.assert_array_equal(rawState.posesAtTimestepsGrad, np.zeros(rawState.posesAtTimesteps.shape))
+
+
+@pytest.mark.parametrize('lossFn', [matrixLoss, dictLoss])
+def test_pooled_state_matches_fresh_state(lossFn):
+    mocap = createMocap()
+    mocap.setCustomLoss(lossFn)
+    for seed in range(4):
+        rawState = RawState(seed)
+        expectedLoss, expectedGrads = referenceGradients(rawState, lossFn)
+        assert mocap.wrappedLoss(rawState) == pytest.approx(expectedLoss)
+        for name in GRAD_NAMES:
+            np.testing.assert_allclose(getattr(rawState, name), expectedGrads[name])
+
+
+@pytest.mark.parametrize('asConstraint', [False, True])
+def test_value_only_calls_skip_gradients(asConstraint):
+    mocap = createMocap()
+    if asConstraint:
+        mocap.addZeroConstraint('dict', dictLoss)
+        wrappedLoss = mocap.zeroConstraints['dict']
+    else:
+        mocap.setCustomLoss(dictLoss)
+        wrappedLoss = mocap.wrappedLoss
+
+    for seed in range(3):
+        withGrad = RawState(seed, needGrad=True)
+        valueOnly = RawState(seed, needGrad=False)
+        expectedLoss = wrappedLoss(withGrad)
+        assert wrappedLoss(valueOnly) == pytest.approx(expectedLoss)
+        for name in GRAD_NAMES:
+            assert hasattr(withGrad, name)
+            assert not hasattr(valueOnly, name)
+
+
+def test_unread_matrices_do_not_record_gradients():
+    mocap = createMocap()
+    mocap.setCustomLoss(lambda state: torch.sum(torch.square(state.markerErrorsMatrix)))
+    rawState = RawState(0)
+    mocap.wrappedLoss(rawState)
+
+    state = mocap._statePool
+    assert state._markerErrorsMatrix.requires_grad
+    for leaf in [state._bodyScalesMatrix, state._markerOffsetsMatrix, state._jointErrorsMatrix, state._posesMatrix]:
+        assert not leaf.requires_grad
+    np.testing.assert_allclose(rawState.markerErrorsAtTimestepsGrad, 2 * rawState.markerErrorsAtTimesteps)
+    for name in ['bodyScalesGrad', 'markerOffsetsGrad', 'jointErrorsAtTimestepsGrad', 'posesAtTimestepsGrad']:
+        grad = getattr(rawState, name)
+        assert grad.shape == getattr(rawState, name[:-len('Grad')]).shape
+        np.testing.assert_array_equal(grad, np.zeros(grad.shape))
+
+
+def test_pooled_state_rebuilds_when_incompatible():
+    mocap = createMocap()
+    mocap.setCustomLoss(dictLoss)
+
+    first = RawState(0)
+    mocap.wrappedLoss(first)
+    firstState = mocap._statePool
+
+    # A different number of timesteps changes the shapes
+    longer = RawState(1, numTimesteps=6)
+    expectedLoss, expectedGrads = referenceGradients(longer, dictLoss)
+    assert mocap.wrappedLoss(longer) == pytest.approx(expectedLoss)
+    assert mocap._statePool is not firstState
+    assert mocap._statePool.numTimesteps == 6
+    for name in GRAD_NAMES:
+        np.testing.assert_allclose(getattr(longer, name), expectedGrads[name])
+    longerState = mocap._statePool
+
+    # The same shapes, but with the joints in a different order
+    reordered = RawState(2, numTimesteps=6)
+    reordered.jointOrder = list(reversed(reordered.jointOrder))
+    expectedLoss, expectedGrads = referenceGradients(reordered, dictLoss)
+    assert mocap.wrappedLoss(reordered) == pytest.approx(expectedLoss)
+    assert mocap._statePool is not longerState
+    assert mocap._statePool.jointNameToIdx['joint0'] == 1
+    for name in GRAD_NAMES:
+        np.testing.assert_allclose(getattr(reordered, name), expectedGrads[name])
+
+
+@pytest.mark.skipif(not hasattr(torch, 'compile'), reason='requires torch.compile()')
+@pytest.mark.parametrize('lossFn', [matrixLoss, accessorLoss])
+def test_compiled_loss_matches_eager(lossFn):
+    # If dynamo can't trace the state it silently runs pieces of the loss
+    # eagerly, which would make this test pass without compiling anything
+    torch._dynamo.reset()
+    torch._dynamo.utils.counters.clear()
+
+    eager = createMocap()
+    eager.setCustomLoss(lossFn)
+    compiled = createMocap()
+    compiled.setCustomLoss(lossFn, compileLoss=True)
+
+    # Alternate between value-only and gradient calls, so both mocaps keep
+    # reusing (and switching autograd on and off for) their pooled states,
+    # and switch problem shapes partway through so the loss gets recompiled
+    calls = [(4, False), (4, True), (4, True), (6, False), (6, True), (4, True)]
+    for seed, (numTimesteps, needGrad) in enumerate(calls):
+        eagerState = RawState(seed, numTimesteps=numTimesteps, needGrad=needGrad)
+        compiledState = RawState(seed, numTimesteps=numTimesteps, needGrad=needGrad)
+        eagerLoss = eager.wrappedLoss(eagerState)
+        compiledLoss = compiled.wrappedLoss(compiledState)
+        assert eagerLoss != 0
+        assert compiledLoss != 0
+        assert compiledLoss == pytest.approx(eagerLoss)
+        for name in GRAD_NAMES:
+            if needGrad:
+                np.testing.assert_allclose(getattr(compiledState, name), getattr(eagerState, name))
+            else:
+                assert not hasattr(compiledState, name)
+                assert not hasattr(eagerState, name)
+    assert len(torch._dynamo.utils.counters['graph_break']) == 0
+    assert torch._dynamo.utils.counters['stats']['unique_graphs'] > 0
+    assert compiled._statePool is not None
+    assert compiled._statePool.rawState is None
+    # Compiling shouldn't build any of the by-name views the loss never asked for
+    assert compiled._statePool._markerErrorsAtTimesteps is None
+    assert compiled._statePool._jointErrorsAtTimesteps is None
+
+
+@pytest.mark.parametrize('numTimesteps,numJoints', [(4, 2), (2, 5)])
+def test_num_timesteps(numTimesteps, numJoints):
+    rawState = RawState(0, numTimesteps=numTimesteps, numJoints=numJoints)
+    state = MarkerMocapOptimizationState(rawState)
+    # This used to be the number of rows in the (stacked 3 rows per joint)
+    # joint errors matrix, rather than the number of timesteps
+    assert state.numTimesteps == numTimesteps
+    assert len(state.markerErrorsAtTimesteps) == numTimesteps
+    assert len(state.jointErrorsAtTimesteps) == numTimesteps
+    assert len(state.posesAtTimesteps) == numTimesteps
+    for t in range(numTimesteps):
+        for i, markerName in enumerate(rawState.markerOrder):
+            expected = rawState.markerErrorsAtTimesteps[3 * t:3 * t + 3, i]
+            np.testing.assert_array_equal(state.markerErrorsAtTimesteps[t][markerName].detach().numpy(), expected)
+            np.testing.assert_array_equal(state.markerError(markerName, t).detach().numpy(), expected)
+
+
+@pytest.mark.parametrize('numTimesteps,numJoints', [(4, 2), (2, 5), (3, 3)])
+def test_joint_errors_index_joints_by_row(numTimesteps, numJoints):
+    rawState = RawState(0, numTimesteps=numTimesteps, numJoints=numJoints)
+    state = MarkerMocapOptimizationState(rawState)
+    assert len(state.jointErrorsAtTimesteps) == numTimesteps
+    for t in range(numTimesteps):
+        assert len(state.jointErrorsAtTimesteps[t]) == numJoints
+        for j, jointName in enumerate(rawState.jointOrder):
+            expected = rawState.jointErrorsAtTimesteps[3 * j:3 * j + 3, t]
+            np.testing.assert_array_equal(state.jointErrorsAtTimesteps[t][jointName].detach().numpy(), expected)
+            np.testing.assert_array_equal(state.jointError(jointName, t).detach().numpy(), expected)
+
+    # Gradients have to land back in the same [3 * numJoints, numTimesteps] layout
+    lastJoint = rawState.jointOrder[-1]
+    lastTimestep = numTimesteps - 1
+    state.fillGradients(torch.sum(state.jointErrorsAtTimesteps[lastTimestep][lastJoint]))
+    expectedGrad = np.zeros((3 * numJoints, numTimesteps))
+    expectedGrad[3 * (numJoints - 1):, lastTimestep] = 1
+    np.testing.assert_array_equal(rawState.jointErrorsAtTimestepsGrad, expectedGrad)
+
+
+if __name__ == "__main__":
+    pytest.main()
@@ -265,7 +265,10 @@ bool testFitterGradients(
   return true;
 }
 
-bool testBilevelFitProblemGradients(
+/// BilevelFitProblem holds onto references to its initialization and result,
+/// so this only fills in observations and an initialization that the caller
+/// owns, and leaves creating the problem to the caller.
+void createBilevelFitProblemInputs(
     MarkerFitter& fitter,
     int numPoses,
     double markerDropProb,
@@ -273,10 +276,10 @@ bool testBilevelFitProblemGradients(
     std::vector<dynamics::Joint*> joints,
     const std::map<
         std::string,
-        std::pair<dynamics::BodyNode*, Eigen::Vector3s>>& markersMap)
+        std::pair<dynamics::BodyNode*, Eigen::Vector3s>>& markersMap,
+    std::vector<std::map<std::string, Eigen::Vector3s>>& observations,
+    MarkerInitialization& init)
 {
-  const s_t THRESHOLD = 5e-8;
-
   std::vector<std::pair<dynamics::BodyNode*, Eigen::Vector3s>> markers;
   for (auto pair : markersMap)
   {
@@ -296,7 +299,7 @@ bool testBilevelFitProblemGradients(
       = Eigen::VectorXs::Random(markers.size() * 3) * 0.05;
   Eigen::MatrixXs goldPoses
       = Eigen::MatrixXs::Zero(skel->getNumDofs(), numPoses);
-  std::vector<std::map<std::string, Eigen::Vector3s>> observations;
+  observations.clear();
   Eigen::MatrixXs goldJointCenters
       = Eigen::MatrixXs::Zero(joints.size() * 3, numPoses);
 
@@ -326,11 +329,7 @@ bool testBilevelFitProblemGradients(
   skel->setPositions(Eigen::VectorXs::Zero(skel->getNumDofs()));
   skel->setGroupScales(originalGroupScales);
 
-  // 3. Create a BilevelFitProblem
-  std::shared_ptr<BilevelFitResult> tmpResult
-      = std::make_shared<BilevelFitResult>();
-
-  MarkerInitialization init;
+  // 3. Initialize near the gold values
   init.poses = goldPoses
                + Eigen::MatrixXs::Random(skel->getNumDofs(), numPoses) * 0.07;
   for (int i = 0; i < fitter.getNumMarkers(); i++)
@@ -344,7 +343,34 @@ bool testBilevelFitProblemGradients(
       = goldJointCenters
         + Eigen::MatrixXs::Random(joints.size() * 3, numPoses) * 0.07;
   init.groupScales = originalGroupScales;
+}
 
+bool testBilevelFitProblemGradients(
+    MarkerFitter& fitter,
+    int numPoses,
+    double markerDropProb,
+    std::shared_ptr<dynamics::Skeleton>& skel,
+    std::vector<dynamics::Joint*> joints,
+    const std::map<
+        std::string,
+        std::pair<dynamics::BodyNode*, Eigen::Vector3s>>& markersMap)
+{
+  const s_t THRESHOLD = 5e-8;
+
+  std::vector<std::map<std::string, Eigen::Vector3s>> observations;
+  MarkerInitialization init;
+  createBilevelFitProblemInputs(
+      fitter,
+      numPoses,
+      markerDropProb,
+      skel,
+      joints,
+      markersMap,
+      observations,
+      init);
+
+  std::shared_ptr<BilevelFitResult> tmpResult
+      = std::make_shared<BilevelFitResult>();
   BilevelFitProblem problem(&fitter, observations, init, numPoses, tmpResult);
 
   Eigen::VectorXs x = problem.getInitialization();
@@ -417,9 +443,9 @@ bool testBilevelFitProblemGradients(
     }
 
     Eigen::MatrixXs jacMarkers = jac.block(
-        0, skel->getGroupScaleDim(), jac.rows(), markers.size() * 3);
+        0, skel->getGroupScaleDim(), jac.rows(), markersMap.size() * 3);
     Eigen::MatrixXs jacMarkers_fd = jac_fd.block(
-        0, skel->getGroupScaleDim(), jac.rows(), markers.size() * 3);
+        0, skel->getGroupScaleDim(), jac.rows(), markersMap.size() * 3);
     if (!equals(jacMarkers, jacMarkers_fd, THRESHOLD))
     {
       std::cout << "Error on BilevelFitProblem constraint jac, markers block"
@@ -432,7 +458,7 @@ bool testBilevelFitProblemGradients(
                 << jacMarkers - jacMarkers_fd << std::endl;
     }
 
-    int offset = (skel->getGroupScaleDim()) + (markers.size() * 3);
+    int offset = (skel->getGroupScaleDim()) + (markersMap.size() * 3);
     for (int i = 0; i < numPoses; i++)
     {
       Eigen::MatrixXs jacPos = jac.block(
@@ -1870,6 +1896,134 @@ TEST(MarkerFitter, DERIVATIVES_BALL_JOINTS)
 }
 #endif
 
+std::shared_ptr<dynamics::Skeleton> createNeedGradSkeleton(
+    std::map<std::string, std::pair<dynamics::BodyNode*, Eigen::Vector3s>>&
+        markers)
+{
+  std::shared_ptr<dynamics::Skeleton> osim
+      = OpenSimParser::parseOsim(
+            "dart://sample/osim/Rajagopal2015/Rajagopal2015.osim")
+            .skeleton;
+
+  markers["0"] = std::make_pair(
+      osim->getBodyNode("radius_l"), Eigen::Vector3s::Random());
+  markers["1"] = std::make_pair(
+      osim->getBodyNode("radius_r"), Eigen::Vector3s::Random());
+  markers["2"]
+      = std::make_pair(osim->getBodyNode("tibia_l"), Eigen::Vector3s::Random());
+  markers["3"]
+      = std::make_pair(osim->getBodyNode("tibia_r"), Eigen::Vector3s::Random());
+
+  return osim;
+}
+
+void recordNeedGrad(
+    MarkerFitter& fitter,
+    std::vector<bool>& lossNeedGrad,
+    std::vector<bool>& constraintNeedGrad)
+{
+  // Record what every call into the loss and the constraints asked for
+  fitter.setCustomLossAndGrad([&](MarkerFitterState* state) {
+    lossNeedGrad.push_back(state->needGrad);
+    s_t loss = state->markerErrorsAtTimesteps.squaredNorm()
+               + state->jointErrorsAtTimesteps.squaredNorm();
+    if (state->needGrad)
+    {
+      state->markerErrorsAtTimestepsGrad = 2 * state->markerErrorsAtTimesteps;
+      state->jointErrorsAtTimestepsGrad = 2 * state->jointErrorsAtTimesteps;
+    }
+    return loss;
+  });
+  fitter.addZeroConstraint("recordNeedGrad", [&](MarkerFitterState* state) {
+    constraintNeedGrad.push_back(state->needGrad);
+    return 0.0;
+  });
+}
+
+TEST(MarkerFitter, NEED_GRAD_FLAG)
+{
+  std::map<std::string, std::pair<dynamics::BodyNode*, Eigen::Vector3s>>
+      markers;
+  std::shared_ptr<dynamics::Skeleton> osim = createNeedGradSkeleton(markers);
+  MarkerFitter fitter(osim, markers);
+
+  std::vector<dynamics::Joint*> joints;
+  joints.push_back(osim->getJoint("walker_knee_l"));
+  joints.push_back(osim->getJoint("walker_knee_r"));
+
+  std::vector<bool> lossNeedGrad;
+  std::vector<bool> constraintNeedGrad;
+  recordNeedGrad(fitter, lossNeedGrad, constraintNeedGrad);
+
+  const int numPoses = 3;
+  std::vector<std::map<std::string, Eigen::Vector3s>> observations;
+  MarkerInitialization init;
+  createBilevelFitProblemInputs(
+      fitter, numPoses, 0.0, osim, joints, markers, observations, init);
+
+  std::shared_ptr<BilevelFitResult> tmpResult
+      = std::make_shared<BilevelFitResult>();
+  BilevelFitProblem problem(&fitter, observations, init, numPoses, tmpResult);
+  Eigen::VectorXs x = problem.getInitialization();
+
+  problem.getLoss(x);
+  EXPECT_EQ(lossNeedGrad, std::vector<bool>({false}));
+  lossNeedGrad.clear();
+
+  problem.getGradient(x);
+  EXPECT_EQ(lossNeedGrad, std::vector<bool>({true}));
+  lossNeedGrad.clear();
+
+  problem.getConstraints(x);
+  EXPECT_EQ(constraintNeedGrad, std::vector<bool>({false}));
+  constraintNeedGrad.clear();
+
+  problem.getConstraintsJacobian(x);
+  EXPECT_EQ(constraintNeedGrad, std::vector<bool>({true}));
+  constraintNeedGrad.clear();
+}
+
+#ifdef ALL_TESTS
+TEST(MarkerFitter, NEED_GRAD_FLAG_FINITE_DIFFERENCES)
+{
+  std::map<std::string, std::pair<dynamics::BodyNode*, Eigen::Vector3s>>
+      markers;
+  std::shared_ptr<dynamics::Skeleton> osim = createNeedGradSkeleton(markers);
+  MarkerFitter fitter(osim, markers);
+
+  std::vector<dynamics::Joint*> joints;
+  joints.push_back(osim->getJoint("walker_knee_l"));
+  joints.push_back(osim->getJoint("walker_knee_r"));
+
+  std::vector<bool> lossNeedGrad;
+  std::vector<bool> constraintNeedGrad;
+  recordNeedGrad(fitter, lossNeedGrad, constraintNeedGrad);
+
+  const int numPoses = 3;
+  std::vector<std::map<std::string, Eigen::Vector3s>> observations;
+  MarkerInitialization init;
+  createBilevelFitProblemInputs(
+      fitter, numPoses, 0.0, osim, joints, markers, observations, init);
+
+  std::shared_ptr<BilevelFitResult> tmpResult
+      = std::make_shared<BilevelFitResult>();
+  BilevelFitProblem problem(&fitter, observations, init, numPoses, tmpResult);
+  Eigen::VectorXs x = problem.getInitialization();
+
+  // Finite differencing only ever asks for the value of the loss
+  const s_t THRESHOLD = 5e-8;
+  Eigen::VectorXs grad = problem.getGradient(x);
+  Eigen::VectorXs grad_fd = problem.finiteDifferenceGradient(x);
+  EXPECT_TRUE(equals(grad, grad_fd, THRESHOLD));
+  EXPECT_EQ(lossNeedGrad.size(), (size_t)(1 + 2 * x.size()));
+  EXPECT_TRUE(lossNeedGrad[0]);
+  for (int i = 1; i < lossNeedGrad.size(); i++)
+  {
+    EXPECT_FALSE(lossNeedGrad[i]);
+  }
+}
+#endif
+
 // #ifdef ALL_TESTS
 TEST(MarkerFitter, DERIVATIVES_ARNOLD)
 {